@@ -1,45 +1,216 @@
 # app.py
+import hashlib
+import itertools
 import os
+import pickle
+import re
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import streamlit as st
-from sqlalchemy import create_engine, text
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import IntegrityError
 import plotly.express as px
 
+try:
+    import duckdb
+except ImportError:  # optional: analyses then run against SQLite
+    duckdb = None
+
 # ---- PAGE CONFIG ----
 st.set_page_config(page_title="Local Food Donation Dashboard", layout="wide")
 
 # ---- DATABASE CONNECTION (SQLite) ----
 DB_FILE = "local_food_donation.db"
-engine = create_engine(f"sqlite:///{DB_FILE}", echo=False, connect_args={"check_same_thread": False})
+
+@st.cache_resource
+def get_engine():
+    """Create the engine once per server process and share it across sessions and reruns."""
+    engine = create_engine(f"sqlite:///{DB_FILE}", echo=False, pool_size=5,
+                           connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, _):
+        """WAL + synchronous=NORMAL: commits no longer fsync the main file on every write."""
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL;")
+        cur.execute("PRAGMA synchronous=NORMAL;")
+        cur.close()
+
+    return engine
 
 # ---- QUERY FUNCTIONS ----
-@st.cache_data(ttl=60)
-def q(sql, params=None):
-    """Execute a SELECT query and return a dataframe."""
-    with engine.connect() as conn:
+COMPACT_INT_COLUMNS = ("food_id", "provider_id", "quantity")
+COMPACT_CATEGORY_COLUMNS = ("food_type", "meal_type", "city", "provider_name")
+
+def _compact(df):
+    """Downcast ids/quantities and categorize repeating strings to shrink the cached and rendered frame."""
+    for c in COMPACT_INT_COLUMNS:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], downcast="unsigned")
+    for c in COMPACT_CATEGORY_COLUMNS:
+        if c in df.columns:
+            df[c] = df[c].astype("category")
+    return df
+
+def _read_sql(sql, params=None):
+    """Execute a SELECT query and return an Arrow-backed dataframe (hands off to st.dataframe without conversion)."""
+    with get_engine().connect() as conn:
         if params:
-            df = pd.read_sql(text(sql), conn, params=params)
+            df = pd.read_sql(text(sql), conn, params=params, dtype_backend="pyarrow")
         else:
-            df = pd.read_sql(text(sql), conn)
+            df = pd.read_sql(text(sql), conn, dtype_backend="pyarrow")
+    return _compact(df)
+
+# ---- SHARED QUERY CACHE (optional Redis) ----
+# st.cache_data is per-process; with REDIS_URL set, results are also shared
+# across sessions and processes. Configure the server with an LFU policy,
+# e.g. `maxmemory-policy allkeys-lfu`.
+REDIS_URL = os.getenv("REDIS_URL")
+CACHE_PREFIX = "lfd:q:"
+
+@st.cache_resource
+def get_redis():
+    """Return a Redis client when REDIS_URL is set, else None."""
+    if not REDIS_URL:
+        return None
+    import redis
+    return redis.Redis.from_url(REDIS_URL)
+
+def _shared_key(sql, params, versions):
+    """Redis key for one result; it embeds the versions, so a table change moves readers to a new key."""
+    return CACHE_PREFIX + hashlib.blake2b(f"{sql}|{params}|{versions}".encode()).hexdigest()
+
+def _shared_read(sql, params, ttl, versions):
+    """Read through Redis when configured, falling back to the database on any cache error.
+
+    Keys carry the table versions, so stale entries are never read again and simply expire after `ttl`.
+    """
+    r = get_redis()
+    if r is None:
+        return _read_sql(sql, params)
+    key = _shared_key(sql, params, versions)
+    try:
+        blob = r.get(key)
+        if blob:
+            return pickle.loads(blob)
+    except Exception:
+        return _read_sql(sql, params)
+    df = _read_sql(sql, params)
+    try:
+        r.setex(key, ttl, pickle.dumps(df))
+    except Exception:
+        pass
     return df
 
-def exec_write(sql, params=None):
-    """Execute INSERT, UPDATE, DELETE queries."""
-    with engine.begin() as conn:
-        conn.execute(text(sql), params or {})
+def exec_writes(statements):
+    """Execute a batch of (sql, params) writes in one transaction.
+
+    Consecutive statements sharing the same SQL are coalesced into a single executemany.
+    """
+    with get_engine().begin() as conn:
+        for sql, group in itertools.groupby(statements, key=lambda stmt: stmt[0]):
+            rows = [r for _, p in group for r in (p if isinstance(p, list) else [p or {}])]
+            conn.execute(text(sql), rows)
+        refresh_materialized_views(conn)
 
 # ---- LOAD CSVS INTO DATABASE ----
+TABLE_SCHEMAS = {
+    "providers": "provider_id BIGINT, name TEXT, type TEXT, address TEXT, city TEXT, contact TEXT",
+    "receivers": "receiver_id BIGINT, name TEXT, type TEXT, city TEXT, contact TEXT",
+    "food_listings": "food_id BIGINT, food_name TEXT, quantity BIGINT, expiry_date TEXT, provider_id BIGINT, "
+                     "provider_type TEXT, location TEXT, food_type TEXT, meal_type TEXT",
+    "claims": "claim_id BIGINT, food_id BIGINT, receiver_id BIGINT, status TEXT, timestamp TEXT",
+}
+TABLE_KEYS = {"providers": "provider_id", "receivers": "receiver_id", "food_listings": "food_id", "claims": "claim_id"}
+
+def id_index_ddl(table_name):
+    """DDL for the unique index on a table's id column."""
+    return f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{table_name}_id ON {table_name} ({TABLE_KEYS[table_name]});"
+
+CSV_CHUNK_SIZE = 50_000
+SQL_TO_PANDAS_DTYPE = {"BIGINT": "int32", "TEXT": "str"}
+
+def csv_dtypes(table_name):
+    """Map each column in TABLE_SCHEMAS to the pandas dtype used when reading its CSV."""
+    cols = (c.split() for c in TABLE_SCHEMAS[table_name].split(","))
+    return {name: SQL_TO_PANDAS_DTYPE[sql_type] for name, sql_type in cols}
+
+def read_csv_chunks(table_name, csv_file):
+    """Parse the CSV in typed chunks with lower-cased column names."""
+    columns = [c.lower() for c in pd.read_csv(csv_file, nrows=0).columns]
+    return pd.read_csv(csv_file, header=0, names=columns, dtype=csv_dtypes(table_name),
+                       chunksize=CSV_CHUNK_SIZE)
+
+def parquet_path(table_name, csv_file):
+    """Return the zstd Parquet copy of a CSV, (re)writing it when missing or older than the CSV."""
+    path = os.path.splitext(csv_file)[0] + ".parquet"
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(csv_file):
+        # Write beside it and rename on success, so an interrupted seed never leaves a partial copy at `path`.
+        tmp = f"{path}.{os.getpid()}.tmp"
+        writer = None
+        try:
+            for chunk in read_csv_chunks(table_name, csv_file):
+                batch = pa.Table.from_pandas(chunk, preserve_index=False)
+                writer = writer or pq.ParquetWriter(tmp, batch.schema, compression="zstd")
+                writer.write_table(batch)
+            if writer is not None:
+                writer.close()
+                writer = None
+                os.replace(tmp, path)
+        finally:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return path
+
+def source_chunks(table_name, csv_file):
+    """Yield typed DataFrame chunks, read from the memory-mapped Parquet copy when it is usable."""
+    try:
+        parquet = pq.ParquetFile(parquet_path(table_name, csv_file), memory_map=True)
+    except (OSError, pa.ArrowException):
+        yield from read_csv_chunks(table_name, csv_file)
+        return
+    for batch in parquet.iter_batches(batch_size=CSV_CHUNK_SIZE):
+        yield batch.to_pandas()
+
+def copy_chunk(cur, table_name, chunk):
+    """Insert one DataFrame chunk with a single executemany; returns the number of rows written."""
+    placeholders = ",".join("?" for _ in chunk.columns)
+    cur.executemany(
+        f"INSERT OR IGNORE INTO {table_name} ({','.join(chunk.columns)}) VALUES ({placeholders});",
+        chunk.itertuples(index=False, name=None),
+    )
+    return cur.rowcount
+
 def load_csv_if_empty(table_name, csv_file):
-    """Load CSV into SQLite only if table is empty."""
+    """Load CSV into SQLite only if table is empty; returns the rows loaded, or None if it had data.
+
+    Rows come in typed chunks of CSV_CHUNK_SIZE from a Parquet copy of the
+    CSV (written once, so later loads skip CSV parsing) and each chunk goes
+    to one executemany (SQLite has no COPY); the whole load is a single
+    transaction with bounded memory. The unique id index is created with the
+    table, so INSERT OR IGNORE drops rows with a duplicate id.
+    """
     try:
-        count = q(f"SELECT COUNT(*) AS cnt FROM {table_name};")["cnt"][0]
+        count = _read_sql(f"SELECT COUNT(*) AS cnt FROM {table_name};")["cnt"][0]
     except Exception:
         count = 0
     if count == 0:
-        df = pd.read_csv(csv_file)
-        df.columns = [c.lower() for c in df.columns]
-        df.to_sql(table_name, engine, if_exists="append", index=False)
-        st.info(f"📥 Loaded {table_name} from CSV ({len(df)} rows)")
+        chunks = source_chunks(table_name, csv_file)
+        conn = get_engine().raw_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({TABLE_SCHEMAS[table_name]});")
+            cur.execute(id_index_ddl(table_name))
+            rows = sum(copy_chunk(cur, table_name, chunk) for chunk in chunks)
+            conn.commit()
+        finally:
+            conn.close()
+        return rows
 
 # ---- CSV FILES ----
 csv_files = {
@@ -49,71 +220,365 @@ csv_files = {
     "claims": "claims_clean_dataset.csv"
 }
 
-# Load CSVs into DB if empty
-for table, file in csv_files.items():
-    load_csv_if_empty(table, file)
+@st.cache_resource
+def seed_tables():
+    """Load empty tables from their CSVs once per server process; returns {table: rows loaded}."""
+    loaded = {}
+    for table, file in csv_files.items():
+        rows = load_csv_if_empty(table, file)
+        if rows is not None:
+            loaded[table] = rows
+    return loaded
+
+# Load CSVs into DB if empty; tell each session about it once.
+seeded = seed_tables()
+if seeded and not st.session_state.get("seed_reported"):
+    st.session_state["seed_reported"] = True
+    for table, rows in seeded.items():
+        st.info(f"📥 Loaded {table} from CSV ({rows} rows)")
+
+# ---- INDEXES ----
+# Secondary indexes are created after the bulk load. The unique id indexes (id_index_ddl) come
+# with the table and back the ON CONFLICT upserts in the CRUD tabs; ensure_indexes adds them to
+# databases created without them.
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_providers_name ON providers (name);",
+    "CREATE INDEX IF NOT EXISTS ix_food_listings_filters "
+    "ON food_listings (location, food_type, meal_type, expiry_date, quantity DESC);",
+    "CREATE INDEX IF NOT EXISTS ix_food_listings_provider ON food_listings (provider_id);",
+    "CREATE INDEX IF NOT EXISTS ix_food_listings_expiry ON food_listings (expiry_date, quantity DESC);",
+    "CREATE INDEX IF NOT EXISTS ix_food_listings_quantity ON food_listings (quantity DESC, food_id);",
+    "CREATE INDEX IF NOT EXISTS ix_food_listings_name ON food_listings (food_name, food_id);",
+    "CREATE INDEX IF NOT EXISTS ix_claims_food ON claims (food_id);",
+    "CREATE INDEX IF NOT EXISTS ix_claims_receiver ON claims (receiver_id);",
+    "CREATE INDEX IF NOT EXISTS ix_claims_completed ON claims (food_id) WHERE status = 'Completed';",
+]
+
+@st.cache_resource
+def ensure_indexes():
+    """Create missing indexes once per server process, then refresh planner statistics.
+
+    A table whose ids are not unique cannot get its unique index: that is reported instead of
+    failing on every start, and upserts into that table fail until the duplicates are removed.
+    """
+    for table_name, key in TABLE_KEYS.items():
+        try:
+            with get_engine().begin() as conn:
+                conn.execute(text(id_index_ddl(table_name)))
+        except IntegrityError:
+            st.error(f"⚠️ {table_name} has duplicate {key} values; saving to it will fail until they are removed.")
+    with get_engine().begin() as conn:
+        for ddl in INDEXES:
+            conn.execute(text(ddl))
+        conn.execute(text("PRAGMA optimize;"))
+
+ensure_indexes()
+
+# ---- CHANGE TRACKING ----
+@st.cache_resource
+def ensure_change_tracking():
+    """Create the table_versions counters and the triggers that bump them."""
+    with get_engine().begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS table_versions "
+                          "(name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0);"))
+        for t in TABLE_SCHEMAS:
+            conn.execute(text("INSERT OR IGNORE INTO table_versions (name) VALUES (:t);"), {"t": t})
+            for op in ("INSERT", "UPDATE", "DELETE"):
+                conn.execute(text(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{t}_{op.lower()} AFTER {op} ON {t}
+                    BEGIN UPDATE table_versions SET version = version + 1 WHERE name = '{t}'; END;
+                """))
+
+def load_table_versions():
+    """Read the {table: version} counters maintained by the change-tracking triggers."""
+    with get_engine().connect() as conn:
+        return dict(conn.execute(text("SELECT name, version FROM table_versions;")).all())
+
+ensure_change_tracking()
+TABLE_VERSIONS = load_table_versions()
+
+# ---- MATERIALIZED VIEWS ----
+# SQLite has no materialized views, so the heavy analyses are kept as summary tables.
+# They are rebuilt in the same transaction as every CRUD write (see exec_writes) and
+# whenever the table versions show a change made elsewhere. `mv_stamp` records the
+# SUM(version) of table_versions they were built from; the counters only grow, so the
+# summaries are current exactly when the stamp still matches.
+MATERIALIZED_VIEWS = {
+    "mv_claims_per_food": ("food_id", """
+        SELECT f.food_id, f.food_name, COUNT(c.claim_id) AS claims_count
+        FROM food_listings f
+        LEFT JOIN claims c ON f.food_id = c.food_id
+        GROUP BY f.food_id, f.food_name
+    """),
+    "mv_top_provider": ("provider_id", """
+        SELECT p.provider_id, p.name, COUNT(c.claim_id) AS successful_claims
+        FROM claims c
+        JOIN food_listings f ON c.food_id = f.food_id
+        JOIN providers p ON f.provider_id = p.provider_id
+        WHERE c.status = 'Completed'
+        GROUP BY p.provider_id, p.name
+    """),
+    "mv_claim_status_pct": ("status", """
+        SELECT status, ROUND(CAST(COUNT(*) AS FLOAT) * 100.0 / (SELECT COUNT(*) FROM claims),2) AS percentage
+        FROM claims
+        GROUP BY status
+    """),
+    "mv_avg_qty_per_receiver": ("receiver_id", """
+        SELECT r.receiver_id, r.name, ROUND(AVG(f.quantity),2) AS avg_quantity
+        FROM claims c
+        JOIN food_listings f ON c.food_id = f.food_id
+        JOIN receivers r ON c.receiver_id = r.receiver_id
+        GROUP BY r.receiver_id, r.name
+    """),
+}
+
+MV_SOURCE_VERSION = "(SELECT SUM(version) FROM table_versions)"
+
+def refresh_materialized_views(conn):
+    """Rebuild every summary table on an open transaction unless the stamp shows they are current.
+
+    The stamp is claimed first, which takes the write lock, so concurrent callers rebuild at most
+    once per change; readers keep the old rows until commit.
+    """
+    claimed = conn.execute(text(f"UPDATE mv_stamp SET version = {MV_SOURCE_VERSION} "
+                                f"WHERE version IS NOT {MV_SOURCE_VERSION};")).rowcount
+    if not claimed:
+        return
+    for name, (_, sql) in MATERIALIZED_VIEWS.items():
+        conn.execute(text(f"DELETE FROM {name};"))
+        conn.execute(text(f"INSERT INTO {name} {sql};"))
+
+@st.cache_resource
+def ensure_materialized_views():
+    """Create missing summary tables, their unique indexes and the mv_stamp row once per server process."""
+    with get_engine().begin() as conn:
+        for name, (key, sql) in MATERIALIZED_VIEWS.items():
+            conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} AS {sql};"))
+            conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{name} ON {name} ({key});"))
+        conn.execute(text("CREATE TABLE IF NOT EXISTS mv_stamp "
+                          "(id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER);"))
+        conn.execute(text("INSERT OR IGNORE INTO mv_stamp (id) VALUES (1);"))
+
+@st.cache_resource(max_entries=1)
+def refresh_stale_materialized_views(versions):
+    """Refresh the summary tables after a change made outside the app.
+
+    Keyed on the table versions, so each process checks once per change. The check is a plain read:
+    after a CRUD write, or once another replica has refreshed, it takes no write lock.
+    """
+    with get_engine().connect() as conn:
+        stale = conn.execute(text(f"SELECT version IS NOT {MV_SOURCE_VERSION} FROM mv_stamp;")).scalar()
+    if stale:
+        with get_engine().begin() as conn:
+            refresh_materialized_views(conn)
+
+ensure_materialized_views()
+refresh_stale_materialized_views(tuple(sorted(TABLE_VERSIONS.items())))
+
+# ---- CACHE INVALIDATION ----
+# Cached reads are keyed on the versions of the tables they read. Triggers bump a
+# table's row in `table_versions` on every change, from this process or any other
+# replica sharing the database, and each script run reads the counters once.
+def read_tables(sql):
+    """Return the sorted tables a SELECT reads."""
+    return sorted(set(re.findall(r"\b(?:FROM|JOIN)\s+(\w+)", sql, re.IGNORECASE)))
+
+def _versions_for(sql):
+    """Version key for a SELECT; summary tables are keyed on the base tables they are built from."""
+    tables = set()
+    for t in read_tables(sql):
+        tables.update(read_tables(MATERIALIZED_VIEWS[t][1]) if t in MATERIALIZED_VIEWS else [t])
+    return tuple((t, TABLE_VERSIONS.get(t, 0)) for t in sorted(tables))
+
+def q_fast(sql, params=None, ttl=30):
+    """SELECT for live data (listings, analyses). `ttl` sets the shared-cache expiry."""
+    return _q_fast(sql, params, ttl, _versions_for(sql))
+
+@st.cache_data(max_entries=512)
+def _q_fast(sql, params, ttl, versions):
+    return _shared_read(sql, params, ttl, versions)
+
+def q_ref(sql, params=None):
+    """SELECT for slow-changing reference data (sidebar lookups); long shared-cache expiry."""
+    return _q_ref(sql, params, _versions_for(sql))
+
+@st.cache_data(max_entries=64)
+def _q_ref(sql, params, versions):
+    return _shared_read(sql, params, 1800, versions)
+
+# ---- ANALYTICS SNAPSHOT (optional DuckDB) ----
+SNAPSHOT_TABLES = ["providers", "receivers", "food_listings", "claims"] + list(MATERIALIZED_VIEWS)
+
+@st.cache_resource(max_entries=1)
+def get_duckdb(versions):
+    """Copy the tables the analyses read into an in-memory DuckDB; rebuilt when `versions` changes."""
+    if duckdb is None:
+        return None
+    con = duckdb.connect(":memory:")
+    with get_engine().connect() as conn:
+        for t in SNAPSHOT_TABLES:
+            con.register("snapshot", pd.read_sql(text(f"SELECT * FROM {t};"), conn, dtype_backend="pyarrow"))
+            con.execute(f"CREATE TABLE {t} AS SELECT * FROM snapshot;")
+            con.unregister("snapshot")
+    return con
 
 # ---- PAGE TITLE ----
 st.title("🍽️ Local Food Donation Dashboard")
 st.caption("Filter donations, view contacts, run analyses, visualize results, and perform CRUD operations.")
 
+# ---- LOOKUP VALUES ----
+# Fixed categories shared by the sidebar filters and the CRUD forms; no query needed.
+PROVIDER_TYPES = ['Restaurant','Grocery Store','Supermarket','Bakery','Caterer','Other']
+FOOD_TYPES = ['Vegetarian','Non-Vegetarian','Vegan','Other']
+MEAL_TYPES = ['Breakfast','Lunch','Dinner','Snacks','Other']
+
 # ---- SIDEBAR FILTERS ----
 st.sidebar.header("Filters")
 
+def get_sidebar_options():
+    """Fetch the data-driven sidebar values (cities, providers) in a single tagged UNION query."""
+    df = q_ref("""
+        SELECT 'city' AS k, city AS v FROM providers WHERE city IS NOT NULL
+        UNION SELECT 'city', location FROM food_listings WHERE location IS NOT NULL
+        UNION SELECT 'provider', name FROM providers WHERE name IS NOT NULL
+        ORDER BY k, v;
+    """)
+    # UNION already de-duplicates and the WHERE clauses drop NULLs, so just split by tag.
+    options = df.groupby("k")["v"].agg(list)
+    return {k: options.get(k, []) for k in ("city", "provider")} | {"food_type": FOOD_TYPES, "meal_type": MEAL_TYPES}
+
+sidebar_options = get_sidebar_options()
+
 # Cities
-cities_df = q('SELECT DISTINCT city FROM providers UNION SELECT DISTINCT location AS city FROM food_listings ORDER BY city;')
-cities = cities_df["city"].dropna().unique().tolist()
-city = st.sidebar.selectbox("City", ["(All)"] + cities)
+city = st.sidebar.selectbox("City", ["(All)"] + sidebar_options["city"])
 
 # Providers
-provider_names_df = q('SELECT DISTINCT name FROM providers ORDER BY name;')
-provider_names = provider_names_df["name"].dropna().unique().tolist()
-provider = st.sidebar.selectbox("Provider", ["(All)"] + provider_names)
+provider = st.sidebar.selectbox("Provider", ["(All)"] + sidebar_options["provider"])
 
 # Food Types
-food_types_df = q('SELECT DISTINCT food_type FROM food_listings ORDER BY food_type;')
-food_types = food_types_df["food_type"].dropna().unique().tolist()
-food_type = st.sidebar.selectbox("Food Type", ["(All)"] + food_types)
+food_type = st.sidebar.selectbox("Food Type", ["(All)"] + sidebar_options["food_type"])
 
 # Meal Types
-meal_types_df = q('SELECT DISTINCT meal_type FROM food_listings ORDER BY meal_type;')
-meal_types = meal_types_df["meal_type"].dropna().unique().tolist()
-meal_type = st.sidebar.selectbox("Meal Type", ["(All)"] + meal_types)
+meal_type = st.sidebar.selectbox("Meal Type", ["(All)"] + sidebar_options["meal_type"])
 
 # ---- FILTERED FOOD LISTINGS ----
-def get_filtered_food_listings(city, provider, food_type, meal_type):
-    sql = """
+LISTINGS_PAGE_SIZE = 200
+
+# Static SQL, one statement per combination of active filters: "(All)" filters are left
+# out instead of bound as NULL, so SQLite can SEARCH the filter and name indexes, and the
+# fixed set of statement texts keeps the prepared-statement cache warm across reruns.
+LISTINGS_FILTERS = {"city": "fl.location", "provider": "p.name",
+                    "food_type": "fl.food_type", "meal_type": "fl.meal_type"}
+LISTINGS_FILTER_SETS = [tuple(k for k, on in zip(LISTINGS_FILTERS, mask) if on)
+                        for mask in itertools.product((False, True), repeat=len(LISTINGS_FILTERS))]
+
+def _listings_from_sql(active):
+    """FROM/WHERE clause binding :<filter> for each filter in `active`."""
+    where = " AND ".join(f"{LISTINGS_FILTERS[k]} = :{k}" for k in active) or "1"
+    return f"""
+    FROM food_listings fl
+    JOIN providers p ON p.provider_id = fl.provider_id
+    WHERE {where}
+"""
+# Sorting is done in SQL; each option is (column expression, result column, direction),
+# always ending with food_id so the keyset is unique.
+LISTINGS_SORTS = {
+    "Expiry date (soonest first)": [("fl.expiry_date", "expiry_date", "ASC"), ("fl.quantity", "quantity", "DESC")],
+    "Quantity (largest first)": [("fl.quantity", "quantity", "DESC")],
+    "Food name (A-Z)": [("fl.food_name", "food_name", "ASC")],
+}
+for keys in LISTINGS_SORTS.values():
+    keys.append(("fl.food_id", "food_id", "ASC"))
+
+def _listings_sql(keys, active, seek):
+    """Build the listings SELECT for one sort key list and filter set.
+
+    With `seek`, bind :a0..:aN with the previous page's last row. The plain bound on the
+    leading key lets SQLite start the index range there instead of scanning from page one.
+    """
+    where = ""
+    if seek:
+        branches = []
+        for i, (col, _, direction) in enumerate(keys):
+            op = ">" if direction == "ASC" else "<"
+            equal = [f"{c} = :a{j}" for j, (c, _, _) in enumerate(keys[:i])]
+            branches.append("(" + " AND ".join(equal + [f"{col} {op} :a{i}"]) + ")")
+        lead, _, direction = keys[0]
+        where = f"AND {lead} {'>=' if direction == 'ASC' else '<='} :a0 AND ({' OR '.join(branches)})"
+    order_by = ", ".join(f"{col} {direction}" for col, _, direction in keys)
+    return f"""
     SELECT fl.food_id, fl.food_name, fl.quantity, fl.expiry_date,
            fl.location AS city, fl.food_type, fl.meal_type,
            p.provider_id, p.name AS provider_name, p.contact AS provider_contact
-    FROM food_listings fl
-    JOIN providers p ON p.provider_id = fl.provider_id
-    WHERE 1=1
+    {_listings_from_sql(active)}
+      {where}
+    ORDER BY {order_by}
+    LIMIT :lim;
     """
-    params = {}
-    if city != "(All)":
-        sql += " AND fl.location = :city"
-        params["city"] = city
-    if provider != "(All)":
-        sql += " AND p.name = :provider"
-        params["provider"] = provider
-    if food_type != "(All)":
-        sql += " AND fl.food_type = :food_type"
-        params["food_type"] = food_type
-    if meal_type != "(All)":
-        sql += " AND fl.meal_type = :meal_type"
-        params["meal_type"] = meal_type
-    sql += " ORDER BY fl.expiry_date ASC, fl.quantity DESC;"
-    return q(sql, params)
-
-listings = get_filtered_food_listings(city, provider, food_type, meal_type)
+
+# Keyed on (sort, filters, seek); the first page has no seek clause at all.
+LISTINGS_SQL = {(sort, active, seek): _listings_sql(keys, active, seek)
+                for sort, keys in LISTINGS_SORTS.items() for active in LISTINGS_FILTER_SETS
+                for seek in (False, True)}
+CONTACTS_SQL = {active: "SELECT DISTINCT p.name AS provider_name, p.contact AS provider_contact"
+                        + _listings_from_sql(active) + " ORDER BY provider_name;"
+                for active in LISTINGS_FILTER_SETS}
+
+def get_filtered_food_listings(city, provider, food_type, meal_type, sort_by=next(iter(LISTINGS_SORTS)),
+                               after=None, limit=LISTINGS_PAGE_SIZE):
+    """Return (listings, contacts) for the filters; contacts are de-duplicated in SQL.
+
+    Listings are sorted and keyset-paginated in SQL by LISTINGS_SORTS[sort_by]:
+    `after` is the key of the last row on the previous page, or None for the first page.
+    """
+    params = {k: v for k, v in zip(LISTINGS_FILTERS, (city, provider, food_type, meal_type)) if v != "(All)"}
+    active = tuple(params)
+    keyset = {} if after is None else {f"a{i}": v for i, v in enumerate(after)}
+    # The two reads are independent: run them on separate pooled connections at the same time.
+    # Worker threads get this script run's context so st.cache_data behaves as on the main thread.
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=2, initializer=lambda: add_script_run_ctx(ctx=ctx)) as pool:
+        listings = pool.submit(q_fast, LISTINGS_SQL[sort_by, active, after is not None], dict(params, **keyset, lim=limit))
+        contacts = pool.submit(q_fast, CONTACTS_SQL[active], params)
+        return listings.result(), contacts.result()
+
 st.subheader("📋 Available Food Listings")
+sort_by = st.selectbox("Sort listings by", list(LISTINGS_SORTS), key="listings_sort")
+
+# Page cursors live in session state: listing_cursors[i] is the `after` key for page i.
+filters = (city, provider, food_type, meal_type, sort_by)
+if st.session_state.get("listing_filters") != filters:
+    st.session_state["listing_filters"] = filters
+    st.session_state["listing_cursors"] = [None]
+cursors = st.session_state["listing_cursors"]
+
+# Fetch one extra row to know whether a next page exists.
+listings, contacts = get_filtered_food_listings(city, provider, food_type, meal_type, sort_by,
+                                                after=cursors[-1], limit=LISTINGS_PAGE_SIZE + 1)
+has_next = len(listings) > LISTINGS_PAGE_SIZE
+listings = listings.head(LISTINGS_PAGE_SIZE)
+if has_next:
+    last = listings.iloc[-1]
+    st.session_state["listing_next_cursor"] = tuple(
+        int(last[c]) if pd.api.types.is_integer_dtype(listings[c]) else str(last[c])
+        for _, c, _ in LISTINGS_SORTS[sort_by]
+    )
+
+def _next_page():
+    st.session_state["listing_cursors"].append(st.session_state["listing_next_cursor"])
+
+def _prev_page():
+    st.session_state["listing_cursors"].pop()
+
 st.dataframe(listings, use_container_width=True)
+prev_col, page_col, next_col = st.columns([1, 2, 1])
+prev_col.button("◀ Previous", key="listings_prev", disabled=len(cursors) == 1, on_click=_prev_page)
+page_col.caption(f"Page {len(cursors)} · {LISTINGS_PAGE_SIZE} listings per page")
+next_col.button("Next ▶", key="listings_next", disabled=not has_next, on_click=_next_page)
 
 # ---- CONTACT PROVIDERS ----
 with st.expander("📇 Contact Providers in Current View"):
-    if not listings.empty:
-        contacts = listings[["provider_name", "provider_contact"]].drop_duplicates().reset_index(drop=True)
+    if not contacts.empty:
         st.dataframe(contacts, use_container_width=True)
     else:
         st.info("No providers found for the selected filters.")
@@ -121,73 +586,102 @@ with st.expander("📇 Contact Providers in Current View"):
 # ---- SQL ANALYSIS QUERIES ----
 st.subheader("📊 SQL Analyses")
 query_map = {
-    "Providers per city": 'SELECT city, COUNT(*) AS provider_count FROM providers GROUP BY city ORDER BY provider_count DESC;',
-    "Receivers per city": 'SELECT city, COUNT(*) AS receiver_count FROM receivers GROUP BY city ORDER BY receiver_count DESC;',
-    "Top provider type by quantity": 'SELECT provider_type, SUM(quantity) AS total_quantity FROM food_listings GROUP BY provider_type ORDER BY total_quantity DESC;',
+    "Providers per city": 'SELECT city, COUNT(*) AS provider_count FROM providers GROUP BY city ORDER BY provider_count DESC, city;',
+    "Receivers per city": 'SELECT city, COUNT(*) AS receiver_count FROM receivers GROUP BY city ORDER BY receiver_count DESC, city;',
+    "Top provider type by quantity": 'SELECT provider_type, CAST(SUM(quantity) AS BIGINT) AS total_quantity FROM food_listings GROUP BY provider_type ORDER BY total_quantity DESC, provider_type;',
     "Top receiver by claims": '''
         SELECT r.receiver_id, r.name, COUNT(c.claim_id) AS total_claims
         FROM claims c 
         JOIN receivers r ON c.receiver_id = r.receiver_id
         GROUP BY r.receiver_id, r.name
-        ORDER BY total_claims DESC
+        ORDER BY total_claims DESC, r.receiver_id
         LIMIT 1;
     ''',
-    "Total available quantity (not expired)": 'SELECT SUM(quantity) AS total_available FROM food_listings;',
-    "City with most food listings": 'SELECT location AS city, COUNT(*) AS listings_count FROM food_listings GROUP BY location ORDER BY listings_count DESC;',
-    "Most common food types": 'SELECT food_type, COUNT(*) AS count_type FROM food_listings GROUP BY food_type ORDER BY count_type DESC;',
-    "Claims per food item": '''
-        SELECT f.food_id, f.food_name, COUNT(c.claim_id) AS claims_count
-        FROM food_listings f
-        LEFT JOIN claims c ON f.food_id = c.food_id
-        GROUP BY f.food_id, f.food_name
-        ORDER BY claims_count DESC;
-    ''',
-    "Top provider by successful claims": '''
-        SELECT p.provider_id, p.name, COUNT(c.claim_id) AS successful_claims
-        FROM claims c
-        JOIN food_listings f ON c.food_id = f.food_id
-        JOIN providers p ON f.provider_id = p.provider_id
-        WHERE c.status = 'Completed'
-        GROUP BY p.provider_id, p.name
-        ORDER BY successful_claims DESC;
-    ''',
-    "Percentage of claim statuses": '''
-        SELECT status, ROUND(CAST(COUNT(*) AS FLOAT) * 100.0 / (SELECT COUNT(*) FROM claims),2) AS percentage
-        FROM claims
-        GROUP BY status;
-    ''',
-    "Average quantity claimed per receiver": '''
-        SELECT r.receiver_id, r.name, ROUND(AVG(f.quantity),2) AS avg_quantity
-        FROM claims c
-        JOIN food_listings f ON c.food_id = f.food_id
-        JOIN receivers r ON c.receiver_id = r.receiver_id
-        GROUP BY r.receiver_id, r.name
-        ORDER BY avg_quantity DESC;
-    ''',
+    "Total available quantity (not expired)": 'SELECT CAST(SUM(quantity) AS BIGINT) AS total_available FROM food_listings;',
+    "City with most food listings": 'SELECT location AS city, COUNT(*) AS listings_count FROM food_listings GROUP BY location ORDER BY listings_count DESC, city;',
+    "Most common food types": 'SELECT food_type, COUNT(*) AS count_type FROM food_listings GROUP BY food_type ORDER BY count_type DESC, food_type;',
+    "Claims per food item": 'SELECT * FROM mv_claims_per_food ORDER BY claims_count DESC, food_id;',
+    "Top provider by successful claims": 'SELECT * FROM mv_top_provider ORDER BY successful_claims DESC, provider_id;',
+    "Percentage of claim statuses": 'SELECT * FROM mv_claim_status_pct ORDER BY status;',
+    "Average quantity claimed per receiver": 'SELECT * FROM mv_avg_qty_per_receiver ORDER BY avg_quantity DESC, receiver_id;',
     "Most claimed meal type": '''
         SELECT f.meal_type, COUNT(c.claim_id) AS claims_count
         FROM claims c
         JOIN food_listings f ON c.food_id = f.food_id
         GROUP BY f.meal_type
-        ORDER BY claims_count DESC;
+        ORDER BY claims_count DESC, f.meal_type;
     ''',
     "Total quantity donated by each provider": '''
-        SELECT p.provider_id, p.name, SUM(f.quantity) AS total_donated
+        SELECT p.provider_id, p.name, CAST(SUM(f.quantity) AS BIGINT) AS total_donated
         FROM food_listings f
         JOIN providers p ON f.provider_id = p.provider_id
         GROUP BY p.provider_id, p.name
-        ORDER BY total_donated DESC;
+        ORDER BY total_donated DESC, p.provider_id;
     ''',
     "Expired but unclaimed food items": '''
         SELECT f.food_id, f.food_name, f.expiry_date, f.quantity
         FROM food_listings f
         LEFT JOIN claims c ON f.food_id = c.food_id
-        WHERE c.claim_id IS NULL;
+        WHERE c.claim_id IS NULL
+        ORDER BY f.food_id;
     '''
 }
 
+# Shared-cache expiry per analysis (seconds); unlisted ones use 30.
+ANALYSIS_TTL = {
+    "Providers per city": 600,
+    "Receivers per city": 600,
+    "Top receiver by claims": 10,
+    "Claims per food item": 10,
+    "Top provider by successful claims": 10,
+    "Percentage of claim statuses": 10,
+    "Average quantity claimed per receiver": 10,
+    "Most claimed meal type": 10,
+    "Expired but unclaimed food items": 10,
+}
+
+def run_analyses(labels, versions):
+    """Run the given query_map analyses on the DuckDB snapshot for `versions`, or on SQLite without it."""
+    con = get_duckdb(versions)
+    if con is not None:
+        # One cursor per call: the shared connection is used from many sessions' threads.
+        cur = con.cursor()
+        return {label: _compact(cur.execute(query_map[label]).df()) for label in labels}
+    with get_engine().connect() as conn:
+        return {label: _compact(pd.read_sql(text(query_map[label]), conn, dtype_backend="pyarrow"))
+                for label in labels}
+
+def all_analyses():
+    """Every query_map result, fetched together; recomputed when a table they read changes."""
+    return _all_analyses(_versions_for(" ".join(query_map.values())))
+
+@st.cache_data(max_entries=4)
+def _all_analyses(versions):
+    """Serve what the shared cache already holds and run only the missing analyses, then share those."""
+    r = get_redis()
+    keys = {label: _shared_key(sql, None, _versions_for(sql)) for label, sql in query_map.items()}
+    results = {}
+    if r is not None:
+        try:
+            results = {label: pickle.loads(blob)
+                       for label, blob in zip(keys, r.mget(list(keys.values()))) if blob}
+        except Exception:
+            r = None
+    missing = [label for label in query_map if label not in results]
+    if missing:
+        results |= run_analyses(missing, versions)
+        if r is not None:
+            try:
+                with r.pipeline() as pipe:
+                    for label in missing:
+                        pipe.setex(keys[label], ANALYSIS_TTL.get(label, 30), pickle.dumps(results[label]))
+                    pipe.execute()
+            except Exception:
+                pass
+    return {label: results[label] for label in query_map}
+
 chosen = st.selectbox("Choose an analysis", list(query_map.keys()))
-df = q(query_map[chosen])
+df = all_analyses()[chosen]
 st.dataframe(df, use_container_width=True)
 
 # ---- VISUALIZATIONS ----
@@ -230,6 +724,11 @@ if not df.empty:
 
 # ---- CRUD OPERATIONS ----
 st.subheader("🛠️ CRUD Operations")
+st.caption("Changes are queued and written together when you commit them below.")
+
+def queue_write(sql, params):
+    """Stash a write in this session; it is sent with the rest on commit."""
+    st.session_state.setdefault("pending_writes", []).append((sql, params))
 tab1, tab2, tab3 = st.tabs(["Providers", "Food Listings", "Claims"])
 
 # --- Providers CRUD ---
@@ -237,7 +736,7 @@ with tab1:
     st.markdown("**Create / Update Provider**")
     p_id = st.number_input("Provider ID", min_value=1, step=1, key="p_id")
     p_name = st.text_input("Name", key="p_name")
-    p_type = st.selectbox("Type", ['Restaurant','Grocery Store','Supermarket','Bakery','Caterer','Other'], key="p_type")
+    p_type = st.selectbox("Type", PROVIDER_TYPES, key="p_type")
     p_addr = st.text_input("Address", key="p_addr")
     p_city = st.text_input("City", key="p_city")
     p_contact = st.text_input("Contact", key="p_contact")
@@ -249,13 +748,13 @@ with tab1:
           name=excluded.name, type=excluded.type, address=excluded.address,
           city=excluded.city, contact=excluded.contact;
         """
-        exec_write(sql, {"id": p_id, "name": p_name, "type": p_type, "address": p_addr, "city": p_city, "contact": p_contact})
-        st.success("Provider saved.")
+        queue_write(sql, {"id": p_id, "name": p_name, "type": p_type, "address": p_addr, "city": p_city, "contact": p_contact})
+        st.success("Provider change queued.")
 
     del_id = st.number_input("Delete Provider ID", min_value=1, step=1, key="del_p_id")
     if st.button("Delete Provider", key="del_provider"):
-        exec_write("DELETE FROM providers WHERE provider_id=:id;", {"id": del_id})
-        st.warning("Provider deleted (and their listings cascaded).")
+        queue_write("DELETE FROM providers WHERE provider_id=:id;", {"id": del_id})
+        st.warning("Provider deletion queued.")
 
 # --- Food Listings CRUD ---
 with tab2:
@@ -265,10 +764,10 @@ with tab2:
     f_qty = st.number_input("Quantity", min_value=0, step=1, key="f_qty")
     f_exp = st.date_input("Expiry Date", key="f_exp")
     f_pid = st.number_input("Provider ID (must exist)", min_value=1, step=1, key="f_pid")
-    f_ptype = st.selectbox("Provider Type", ['Restaurant','Grocery Store','Supermarket','Bakery','Caterer','Other'], key="f_ptype")
+    f_ptype = st.selectbox("Provider Type", PROVIDER_TYPES, key="f_ptype")
     f_loc = st.text_input("Location (City)", key="f_loc")
-    f_ftype = st.selectbox("Food Type", ['Vegetarian','Non-Vegetarian','Vegan','Other'], key="f_ftype")
-    f_meal = st.selectbox("Meal Type", ['Breakfast','Lunch','Dinner','Snacks','Other'], key="f_meal")
+    f_ftype = st.selectbox("Food Type", FOOD_TYPES, key="f_ftype")
+    f_meal = st.selectbox("Meal Type", MEAL_TYPES, key="f_meal")
     if st.button("Save Listing", key="save_listing"):
         sql = """
         INSERT INTO food_listings (food_id, food_name, quantity, expiry_date, provider_id, provider_type, location, food_type, meal_type)
@@ -278,20 +777,20 @@ with tab2:
           provider_id=excluded.provider_id, provider_type=excluded.provider_type, location=excluded.location,
           food_type=excluded.food_type, meal_type=excluded.meal_type;
         """
-        exec_write(sql, {"id": f_id,"name": f_name,"qty": f_qty,"exp": f_exp,"pid": f_pid,"ptype": f_ptype,
+        queue_write(sql, {"id": f_id,"name": f_name,"qty": f_qty,"exp": f_exp,"pid": f_pid,"ptype": f_ptype,
                          "loc": f_loc,"ftype": f_ftype,"meal": f_meal})
-        st.success("Listing saved.")
+        st.success("Listing change queued.")
 
     up_food = st.number_input("Update Qty - Food ID", min_value=1, step=1, key="up_food")
     up_qty = st.number_input("New Quantity", min_value=0, step=1, key="up_qty")
     if st.button("Update Quantity", key="update_qty_btn"):
-        exec_write("UPDATE food_listings SET quantity=:q WHERE food_id=:id;", {"q": up_qty, "id": up_food})
-        st.info("Quantity updated.")
+        queue_write("UPDATE food_listings SET quantity=:q WHERE food_id=:id;", {"q": up_qty, "id": up_food})
+        st.info("Quantity update queued.")
 
     del_food = st.number_input("Delete Listing - Food ID", min_value=1, step=1, key="del_food")
     if st.button("Delete Listing", key="del_listing_btn"):
-        exec_write("DELETE FROM food_listings WHERE food_id=:id;", {"id": del_food})
-        st.warning("Listing deleted.")
+        queue_write("DELETE FROM food_listings WHERE food_id=:id;", {"id": del_food})
+        st.warning("Listing deletion queued.")
 
 # --- Claims CRUD ---
 with tab3:
@@ -310,13 +809,34 @@ with tab3:
           food_id=excluded.food_id, receiver_id=excluded.receiver_id,
           status=excluded.status, timestamp=excluded.timestamp;
         """
-        exec_write(sql, {"id": c_id,"food": c_food,"recv": c_recv,"status": c_status,"ts": c_time})
-        st.success("Claim saved.")
+        queue_write(sql, {"id": c_id,"food": c_food,"recv": c_recv,"status": c_status,"ts": c_time})
+        st.success("Claim change queued.")
 
     del_claim = st.number_input("Delete Claim ID", min_value=1, step=1, key="del_claim")
     if st.button("Delete Claim", key="del_claim_btn"):
-        exec_write("DELETE FROM claims WHERE claim_id=:id;", {"id": del_claim})
-        st.warning("Claim deleted.")
+        queue_write("DELETE FROM claims WHERE claim_id=:id;", {"id": del_claim})
+        st.warning("Claim deletion queued.")
+
+# --- Pending writes ---
+# Commit and discard run as callbacks, before the rerun, so the whole page renders the new data.
+def _commit_pending():
+    pending = st.session_state.get("pending_writes", [])
+    exec_writes(pending)
+    st.session_state["pending_writes"] = []
+    st.session_state["pending_notice"] = ("success", f"Committed {len(pending)} change(s).")
+
+def _discard_pending():
+    st.session_state["pending_writes"] = []
+    st.session_state["pending_notice"] = ("info", "Pending changes discarded.")
+
+pending = st.session_state.get("pending_writes", [])
+st.markdown(f"**Pending changes: {len(pending)}**")
+commit_col, discard_col = st.columns(2)
+commit_col.button("Commit pending changes", key="commit_pending", disabled=not pending, on_click=_commit_pending)
+discard_col.button("Discard pending changes", key="discard_pending", disabled=not pending, on_click=_discard_pending)
+if "pending_notice" in st.session_state:
+    kind, message = st.session_state.pop("pending_notice")
+    getattr(st, kind)(message)
 
 
 